@@ -3,15 +3,22 @@
 The following script demonstrates a simple loop to read the magnitude of the
 lockin-amplifier, and temperatures from the SIM922 thermodiode monitor.
 
+The two instruments are on separate connections (USB and serial), so they are
+read at the same time, each in their own thread, using `asyncio`. The
+temperature and thermodiode voltage are read together with a single query.
+
+Each measurement is written to `filename` as soon as it is taken. The rows are
+collected in memory and pushed to disk every `write_interval` seconds, so at
+most that much data is lost if an error occurs or the script is aborted.
+
 There are some practical flaws, which should be fixed before using it in an
 actual experiment:
-    - The data is only saved after all measurements are taken, meaning all data
-      will be lost if an error occurs or the script is aborted
     - The data file given by `filename` is always overwritten, so you are
       likely to erase useful data.
 """
+import asyncio
+import os
 import time
-import numpy as np
 
 # These modules must be in the same directory as this script
 from lockin_7270 import LockIn7270
@@ -21,23 +28,50 @@ lockin = LockIn7270()
 thermo = SIM922()
 
 # NOTE:
-#  Because the delay between measurements is done with `time.sleep()` below,
-#  the sampling period is not controlled precisely.
+#  Each sample is scheduled for a fixed deadline, one `sample_period` after the
+#  previous one, so the timing errors of `asyncio.sleep()` do not add up. The
+#  actual time of each measurement is still recorded.
 sample_period = 1 # seconds
 duration = 60 # Roughly 1 minute
 filename = "measurements.txt"
+write_interval = 1 # seconds between writes to disk
 
 n_samples = duration // sample_period
 
-times, magnitudes, temps, tvolts = [], [], [], []
-start_time = time.time()
-for _ in range(n_samples):
-    magnitudes.push(lockin.get_magnitude())
-    temps.push(thermo.get_T())
-    tvolts.push(thermo.get_V())
-    times.push(time.time() - start_time)
-    time.sleep(sample_period)
-
-# Convert to array with columns
-measurements = np.stack([times, magnitudes, temps, tvolts], axis=1)
-np.savetxt(filename, measurements, header="time (s), mag (V), T (K), T_volt (V)")
+
+def write_rows(fh, buf):
+    """ Write the buffered rows to the file, and make sure they reach the disk """
+    fh.write(buf)
+    buf.clear()
+    fh.flush()
+    os.fsync(fh.fileno())
+
+
+async def measure(start_time):
+    """ Take one measurement, reading both instruments at once """
+    mag, (temp, tvolt) = await asyncio.gather(
+            asyncio.to_thread(lockin.get_magnitude),
+            asyncio.to_thread(thermo.get_TV))
+    return time.monotonic() - start_time, mag, temp, tvolt
+
+
+async def main():
+    with open(filename, 'wb', buffering=64*1024) as fh:
+        fh.write(b"# time (s), mag (V), T (K), T_volt (V)\n")
+        buf = bytearray()
+        start_time = time.monotonic()
+        next_time = start_time
+        last_write = start_time
+        try:
+            for _ in range(n_samples):
+                buf += b"%.6f %.9e %.6f %.9e\n" % await measure(start_time)
+                if time.monotonic() - last_write >= write_interval:
+                    write_rows(fh, buf)
+                    last_write = time.monotonic()
+                next_time += sample_period
+                await asyncio.sleep(max(0.0, next_time - time.monotonic()))
+        finally:
+            # Also runs on errors and KeyboardInterrupt, so no measurements are lost
+            write_rows(fh, buf)
+
+asyncio.run(main())
@@ -33,22 +33,22 @@ from lockin_7270 import LockIn7270
 lockin = LockIn7270()
 
 duration = 60 # Roughly 1 minute
-times, magnitudes = [], []
-start_time = time.time()
-for sample in range(60):
-    magnitudes.push(lockin.get_magnitude())
-    times.push(time.time() - start_time)
-    time.sleep(1)
-
-# Cast to an array for later use
-times = np.array(times)
-magnitudes = np.array(magnitudes)
+times = np.empty(duration)
+magnitudes = np.empty(duration)
+start_time = time.monotonic()
+next_time = start_time
+for sample in range(duration):
+    magnitudes[sample] = lockin.get_magnitude()
+    times[sample] = time.monotonic() - start_time
+    next_time += 1
+    time.sleep(max(0.0, next_time - time.monotonic()))
 ```
 
 Note that `time.sleep()` is not precise, and `lockin.get_magnitude()` takes
 additional time for queries, so it is not possible to precisely control time of
-measurements this way. To account for that, we measure the actual time of the
-measurement using `time.time()`.
+measurements this way. To avoid the errors adding up, each sleep lasts until a
+fixed deadline, 1 s after the previous one, rather than for a fixed time. We
+also measure the actual time of each measurement using `time.monotonic()`.
 
 For curve measurements, refer to the `LockIn7270.run()` method.
 
@@ -59,7 +59,7 @@ from lockin_7270 import LockIn7270
 lockin = LockIn7270()
 
 sample_rate = 10000 # sample rate for the lockin's internal curve buffer
-buffer_length = 10000000 # number of samples to retrieve from the curve buffer
+buffer_length = 100000 # number of samples to retrieve from the curve buffer (max 100,000)
 lockin.curve_setup(sample_rate, buffer_length)
 events[0].set()
 lockin.send("TD") # Must be sent to begin sampling
@@ -72,16 +72,26 @@ self.read_all_curves()
 """
 
 
+import sys
 import time
-import numpy as np
 import array
+try:
+    import numpy as np
+except ImportError:
+    np = None # curves are stored in array.array instead, see _store_curve()
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import usb.core
+import usb.util
+
+_logger = logging.getLogger(__name__)
 
 ###############################################################################
 # Lock in class
 ###############################################################################
 SETUP_CMDS = {
-    "REMODE": 0, "VMODE": 3, "IE": 0,
+    "REFMODE": 0, "VMODE": 3, "IE": 0,
     "DCCOUPLE": 0, "FLOAT": 1, "TC": 12,
     "FET": 0}
 
@@ -99,6 +109,10 @@ AMETEK 7270 manual.
  "FET 0" bipolar device
  """
 
+# Bits of the status byte sent by the lock-in after each reply
+STATUS_INVALID_CMD = 0x02
+STATUS_PARAM_ERROR = 0x04
+
 SENSITIVITY = {1: 2e-9, 2: 5e-9, 3: 10e-9,
                4: 20e-9, 5: 50e-9, 6: 100e-9,
                7: 200e-9, 8: 500e-9, 9: 1e-6,
@@ -109,6 +123,11 @@ SENSITIVITY = {1: 2e-9, 2: 5e-9, 3: 10e-9,
                22: 20e-3, 23: 50e-3, 24: 100e-3,
                25: 200e-3, 26: 500e-3, 27: 1}
 
+# SENSITIVITY as an array, so a whole sensitivity curve can be looked up at once
+SENS_LUT = [SENSITIVITY.get(bit_, 0.0) for bit_ in range(28)]
+if np is not None:
+    SENS_LUT = np.array(SENS_LUT)
+
 class LockIn7270:
     """ Instance of an Ametek 7270 lock in amplifier
 
@@ -133,18 +152,44 @@ class LockIn7270:
         curve_setup(..) - update device settings for new curve measurement
         read_curve(..)  - read curve data for a single attribute into data buffer
         read_all_curves - read all curves into data buffer
+        curves_to_volts - convert the X, Y, and Noise curves to volts
         run(..)         - complete curve measurements
  
         Public Attributes
         ----------------
         dev - lock in device.
-        data - dictionary of stored data measurements.
+        data - dictionary of stored curve measurements, as int16 arrays holding
+               every sample read since the object was created. If numpy is
+               not installed, these are array.array('h') instead.
         ep_in/_out - location of in and out usb endpoints respectively.
+        bulk_chunk - number of bytes requested by each read of a curve. It is
+                     rounded down to a multiple of the packet size (at least
+                     one packet), as libusb needs whole packets.
 
     """
     ID_VENDOR = 2605
     ID_PRODUCT = 27
     EP_WRITE = 1
+    # Number of packets requested by each bulk read when downloading curves.
+    # libusb keeps all of them queued on the endpoint, so the device does not
+    # wait for python between packets.
+    CURVE_PACKETS = 64
+    # Timeout (ms) for the first read of a curve, while the lock-in starts sending
+    CURVE_START_TIMEOUT = 1000
+    # Timeout (ms) for the following reads, which only runs out if the curve
+    # is shorter than expected
+    CURVE_TIMEOUT = 100
+    # Timeout (ms) for the reply to setup commands. "AS" only replies once the
+    # sensitivity has settled, which takes several time constants.
+    SETUP_TIMEOUT = 10000
+    # Commands sent by curve_setup() which don't depend on its arguments
+    _CS_PREAMBLE = [
+        b"AS",  # autosensitivity mode
+        b"NC",  # clear curve buffer
+        b"CMODE 0",  # set curve aquistion to fast mode
+        b"CBD 59",  # store X,Y, phase, sensitivity, Noise
+        b"REFP 0",  # set phase to 0
+    ]
     def __init__(self, cmds=SETUP_CMDS):
         """ Initialize class.
          
@@ -155,47 +200,135 @@ class LockIn7270:
                 should be ran at. key: command name (str), value: command value
                 (int). 
                 Default -> 
-                    "REMODE": 0, "VMODE": 3, "IE": 0,
+                    "REFMODE": 0, "VMODE": 3, "IE": 0,
                     "DCCOUPLE": 0, "FLOAT": 1, "TC": 12, "FET": 0.
                     See lock in manual for more details. 
         """
         # find the device and set the configuration
         self.dev = usb.core.find(idVendor=self.ID_VENDOR, idProduct=self.ID_PRODUCT)
+        try:
+            if self.dev.is_kernel_driver_active(0):
+                self.dev.detach_kernel_driver(0)
+        except NotImplementedError:
+            pass # not supported by the windows backends, where it's not needed
         self.dev.set_configuration()
         # store the lockin set-up commands for a future call to .set_up()
         self.paramaters = cmds
+        intf = self._select_interface()
         # in and out endpoints respectively
-        self.ep_in = self.dev[0].interfaces()[0].endpoints()[1]  # bulk in
-        self.ep_out = self.dev[0].interfaces()[0].endpoints()[0]  # bulk out
+        self.ep_in = self._find_bulk_endpoint(intf, usb.util.ENDPOINT_IN)
+        self.ep_out = self._find_bulk_endpoint(intf, usb.util.ENDPOINT_OUT)
+        self._wmax = self.ep_in.wMaxPacketSize
+        self.bulk_chunk = self._wmax * self.CURVE_PACKETS
+        # held for every use of self.dev, so threads don't mix up their
+        # commands and replies
+        self._dev_lock = threading.RLock()
         # Initialize data storage for reading curves
-        self.data = {0: [], 1: [], 3: [], 4: [], 5: []}  
+        self._len = 0
+        self._expected_bytes = 0
+        self._curves = {}
+        # number of samples already written to each array in _curves
+        self._cursor = {}
+        self._allocate_curves()
+
+    def _select_interface(self):
+        """ Choose the alternate setting of interface 0 with the largest packets.
+
+            Larger packets mean fewer USB transfers for each reply and curve.
+        """
+        alts = [intf for intf in self.dev[0].interfaces() if intf.bInterfaceNumber == 0]
+        # alternate settings without bulk endpoints (e.g. zero-bandwidth) are skipped
+        usable = [intf for intf in alts
+                  if self._find_bulk_endpoint(intf, usb.util.ENDPOINT_IN) is not None
+                  and self._find_bulk_endpoint(intf, usb.util.ENDPOINT_OUT) is not None]
+        if not usable:
+            raise RuntimeError("lock-in has no interface with bulk in and out endpoints")
+        intf = max(usable, key=lambda intf: self._find_bulk_endpoint(
+            intf, usb.util.ENDPOINT_IN).wMaxPacketSize)
+        if len(alts) > 1:
+            self.dev.set_interface_altsetting(intf.bInterfaceNumber, intf.bAlternateSetting)
+        return intf
+
+    @staticmethod
+    def _find_bulk_endpoint(intf, direction):
+        """ Return the bulk endpoint of <intf> in <direction>, or None. """
+        return usb.util.find_descriptor(
+                intf, custom_match=lambda ep:
+                usb.util.endpoint_direction(ep.bEndpointAddress) == direction
+                and usb.util.endpoint_type(ep.bmAttributes) == usb.util.ENDPOINT_TYPE_BULK)
 
     def set_up(self):
-        """ Write settings based on the parameter attribute. """
-        for cmd, value in self.paramaters.items():
-            self.send("{} {}".format(cmd, value))
-        self.send("AS") # autosensitivity mode
+        """ Write settings based on the parameter attribute.
+
+            All settings are sent in a single write, as a compound command
+            separated by semicolons. See _send_compound() for how errors are
+            handled.
+        """
+        cmds = ["{} {}".format(cmd, value) for cmd, value in self.paramaters.items()]
+        cmds.append("AS") # autosensitivity mode
+        self._send_compound(cmds)
+
+    def _send_compound(self, cmds):
+        """ Send the list <cmds> as one compound command, and check the reply.
+
+            If the status byte of the reply flags an invalid command or
+            parameter, it is not known which of the commands were applied, so
+            each one is sent again on its own. A RuntimeError listing the
+            commands that were rejected is then raised.
+        """
+        cmds = [c.encode('ascii') if isinstance(c, str) else c for c in cmds]
+        if self._status_ok(self._query_bytes(b";".join(cmds), self.SETUP_TIMEOUT)):
+            return
+        failed = [c for c in cmds
+                  if not self._status_ok(self._query_bytes(c, self.SETUP_TIMEOUT))]
+        if failed:
+            raise RuntimeError("lock-in rejected commands: {}".format(
+                ", ".join(c.decode('ascii') for c in failed)))
+
+    @staticmethod
+    def _split_reply(reply):
+        """ Split a raw reply into the response and the status byte.
+
+            Over USB, the response is followed by a null byte, the status byte
+            and the overload byte. The status is None if they are missing.
+        """
+        end = reply.find(b'\x00')
+        if end < 0 or end + 1 >= len(reply):
+            return reply, None
+        return reply[:end], reply[end + 1]
+
+    def _status_ok(self, reply):
+        """ Check that the status byte of <reply> flags no command errors. """
+        _, status = self._split_reply(reply)
+        return status is None or not status & (STATUS_INVALID_CMD | STATUS_PARAM_ERROR)
 
     # Basic send and receive methods {{{
     def send(self, cmd):
         """ Sends a command to the lockin device """
-        self.dev.write(self.EP_WRITE, cmd)
+        with self._dev_lock:
+            self.dev.write(self.EP_WRITE, cmd)
 
     def send_list(self, cmdlist):
         """ Sends a list of commands to the lockin device. """
         for cmd in cmdlist:
             self.send(cmd)
 
-    def receive(self):
+    def receive(self, timeout=None):
         """ Reads data from the lockin device. 
 
+            Paramaters
+            ----------
+            timeout : int
+                Time to wait in milliseconds (default: the pyusb default)
+
             returns
             -------
             output : bytes
         """
-        output = self.dev.read(
-                self.ep_in.bEndpointAddress, 
-                self.ep_in.wMaxPacketSize)
+        with self._dev_lock:
+            output = self.dev.read(
+                    self.ep_in.bEndpointAddress, 
+                    self._wmax, timeout)
         return output
 
     # }}}
@@ -203,10 +336,13 @@ class LockIn7270:
     # General Query Methods {{{
     def query(self, cmd, silent=True):
         """ Write and read a command to the lock in instrument, ignoring errors.
+
+            Errors are logged rather than raised, which is convenient when
+            trying commands interactively. Scripts should use query_safe().
             
             Paramaters
             ----------
-            cmd : str
+            cmd : str or bytes
                 The command.
             silent : bool
                 Print the response to console if silent=False
@@ -219,8 +355,8 @@ class LockIn7270:
         response = ''
         try:
             response = self.query_safe(cmd)
-        except:
-            pass
+        except Exception as e:
+            _logger.warning("query %r failed: %s", cmd, e)
         if not silent:
             print(response)
         return response
@@ -230,7 +366,7 @@ class LockIn7270:
             
             Paramaters
             ----------
-            cmd : str
+            cmd : str or bytes
                 The command.
 
             Returns
@@ -238,10 +374,13 @@ class LockIn7270:
             response : str
                 The response from the device as a UTF-8 string.
         """
-        self.dev.write(1, cmd)
-        output = self.receive()
-        result = output.tobytes().decode('utf-8')
-        return result
+        return self._query_bytes(cmd).decode('utf-8')
+
+    def _query_bytes(self, cmd, timeout=None):
+        """ Write and read a command, returning the raw response as bytes. """
+        with self._dev_lock:
+            self.dev.write(1, cmd)
+            return self.receive(timeout).tobytes()
 
     # }}}
 
@@ -264,12 +403,44 @@ class LockIn7270:
         return self._get_float('PHA.')
 
     def _get_float(self, cmd):
-        value_str = self.query_safe(cmd)
-        return float(value_str)
+        # float() parses the ascii bytes directly, without decoding to a str
+        response, _ = self._split_reply(self._query_bytes(cmd))
+        return float(response)
 
     #}}}
 
     # Curve reading methods {{{
+    @property
+    def data(self):
+        """ Dictionary of the curves read so far, containing only the samples
+            actually received (the arrays are views of the internal storage).
+        """
+        return {bit_: curve[:self._cursor[bit_]] for bit_, curve in self._curves.items()}
+
+    def _allocate_curves(self):
+        """ Make room for self._len more samples of each curve.
+
+            The samples already read are kept. The storage at least doubles
+            each time it grows, so repeated sweeps are not copied many times.
+        """
+        for bit_ in (0, 1, 3, 4, 5):
+            curve = self._curves.get(bit_)
+            used = self._cursor.get(bit_, 0)
+            size = 0 if curve is None else len(curve)
+            if size - used >= self._len and curve is not None:
+                continue
+            new_size = max(used + self._len, 2 * size)
+            if np is not None:
+                new_curve = np.zeros(new_size, dtype=np.int16)
+                if curve is not None:
+                    new_curve[:used] = curve[:used]
+            else:
+                new_curve = array.array('h', bytes(2 * new_size))
+                if curve is not None:
+                    new_curve[:used] = curve[:used]
+            self._curves[bit_] = new_curve
+            self._cursor[bit_] = used
+
     def curve_setup(self, sample_rate=10000, len_=100000):
         """ Initialize curve collection settings of the device.
 
@@ -280,16 +451,21 @@ class LockIn7270:
                 mode; 1000 standard mode)
             len_ : int
                 Number of measuremnts to store (max = 100,000)
+
+            This also makes room for <len_> more samples of each curve in the
+            data attribute. Curves from earlier calls are kept.
         """
-        self.dev.write(1, "AS") # autosensitivity mode`
-        self.query("NC", True)  # clear curve buffer
-        self.query("CMODE 0", True)  # set curve aquistion to fast mode
-        self.query("CBD 59", True)  # store X,Y, phase, sensitivity, Noise
-        self.query("LEN {}".format(len_), True)
-        # max len value is 100,000
-        self.query("STR {}".format(sample_rate), True)  # store data every 10 ms [in micro-s]
-        # 10 Hz * 1000000 = 100
-        self.query("REFP 0", True)  # set phase to 0
+        self._len = len_
+        # each curve is sent as 2 bytes per sample, followed by 3 extra bytes
+        self._expected_bytes = len_ * 2 + 3
+        self._allocate_curves()
+        # The commands are sent as one compound command, with a single reply
+        cmds = self._CS_PREAMBLE + [
+            b"LEN %d" % len_,  # max len value is 100,000
+            b"STR %d" % sample_rate,  # store data every 10 ms [in micro-s]
+            # 10 Hz * 1000000 = 100
+        ]
+        self._send_compound(cmds)
 
     def read_curve(self, bit_):
         """ Read and save curve data for the specified <bit_> value. 
@@ -313,41 +489,135 @@ class LockIn7270:
             hardcoded in the dictionary SENSITIVITY above. Use the dictionary to
             get the correct sensitivity values before multiplication. 
         """
-        output = array.array('B')
-        self.dev.write(1, "DCB {}".format(bit_))
-        while True:
-            try:
-                r = self.dev.read(self.ep_in.bEndpointAddress, self.ep_in.wMaxPacketSize)
-                output.extend(r)
-            except:
-                break
-
-        data = []
-        # the len(output)-3 converts all the bytes except the null byte which
-        # takes up the last 3 positions of the output array 
-        for i in range(0, len(output)-3, 2):
-            byte_str = output[i:i+2].tobytes()
-            # see page 6-31 under DCB command for details on the bytes outputted
-            value = int.from_bytes(byte_str, byteorder="big", signed=True)
-            data.append(value)
-        self.data[bit_].extend(data)
+        self._store_curve(bit_, self._download_curve(bit_))
+
+    def _download_curve(self, bit_):
+        """ Read the DCB output for the <bit_> curve into self._curves[bit_].
+
+            The raw bytes are written straight into the memory of the curve's
+            array, after the samples already stored. They are converted to
+            values afterwards by _store_curve().
+
+            The whole reply is read, up to the short packet which ends it, even
+            if it is longer than expected, so nothing is left on the endpoint.
+
+            Returns
+            -------
+            size : int
+                Number of bytes received.
+        """
+        self._check_curve_setup()
+        # pyusb fills the whole `packet` array on every read, and can't read
+        # into a slice of a larger buffer, so each read is copied from here
+        # whole packets only, so a full packet never overflows the buffer, and
+        # a short read always means a short packet
+        read_size = max(self._wmax, self.bulk_chunk // self._wmax * self._wmax)
+        packet = array.array('B', bytes(read_size))
+        packet_view = memoryview(packet)
+        out_view = memoryview(self._curves[bit_]).cast('B')[2 * self._cursor[bit_]:]
+        off = 0
+        with self._dev_lock:
+            self.dev.write(1, "DCB {}".format(bit_))
+            timeout = self.CURVE_START_TIMEOUT
+            while True:
+                try:
+                    r = self.dev.read(self.ep_in.bEndpointAddress, packet, timeout)
+                except usb.core.USBTimeoutError:
+                    break # nothing more was sent
+                timeout = self.CURVE_TIMEOUT
+                # the 3 bytes at the end of the curve, and anything beyond the
+                # room made by curve_setup(), don't fit and are dropped
+                fit = max(0, min(r, len(out_view) - off))
+                out_view[off:off + fit] = packet_view[:fit]
+                off += r
+                # A read shorter than requested ended with a short packet. Once
+                # the whole curve has arrived, that is the end of it, so there
+                # is no need to wait for a timeout.
+                if r < len(packet) and off >= self._expected_bytes:
+                    break
+        return off
+
+    def _check_curve_setup(self):
+        """ Raise an error if curve_setup() has not been called yet. """
+        if self._len == 0:
+            raise RuntimeError("curve_setup() must be called before reading curves")
+
+    def _store_curve(self, bit_, size):
+        """ Convert the <size> bytes from _download_curve() into values. """
+        # the size-3 converts all the bytes except the null byte which takes up
+        # the last 3 positions of the output
+        n = max(size - 3, 0) // 2
+        curve = self._curves[bit_]
+        start = self._cursor[bit_]
+        # never write past the samples allocated in curve_setup()
+        n = min(n, len(curve) - start)
+        # see page 6-31 under DCB command for details on the bytes outputted:
+        # each value is a signed, big-endian 16 bit integer. The bytes are
+        # swapped in place, which numpy does with SIMD instructions, leaving
+        # native int16 values.
+        if sys.byteorder == 'little':
+            if np is not None:
+                curve[start:start + n].byteswap(inplace=True)
+            else:
+                # array.array also swaps the bytes in C, but only on a copy
+                values = curve[start:start + n]
+                values.byteswap()
+                curve[start:start + n] = values
+        self._cursor[bit_] += n
 
     def read_all_curves(self):
         """ Save all curves stored in device buffer to computer.
+
+            The curves are downloaded one after the other in a worker thread,
+            while the main thread decodes the previous curve. Each download
+            only starts once the previous one succeeded, so no more DCB
+            commands are sent after an error.
         """
-        try:
-            r = self.dev.read(self.ep_in.bEndpointAddress, self.ep_in.wMaxPacketSize)
-        except:
-            pass
+        self._check_curve_setup()
+        with self._dev_lock:
+            try:
+                self.dev.read(self.ep_in.bEndpointAddress, self._wmax, self.CURVE_TIMEOUT)
+            except usb.core.USBError:
+                pass # no stale reply to clear
+
+        bits = list(self._curves.keys())
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            download = pool.submit(self._download_curve, bits[0])
+            for i, next_bit in zip(bits, bits[1:] + [None]):
+                size = download.result()
+                if next_bit is not None:
+                    download = pool.submit(self._download_curve, next_bit)
+                self._store_curve(i, size)
+
+    def curves_to_volts(self):
+        """ Convert the X, Y, and Noise curves to floating point values.
+
+            Each value is multiplied by the sensitivity stored at the same time,
+            as described in read_curve(). Only the samples read for all of the
+            curves are converted.
 
-        for i in self.data.keys():
-            self.read_curve(i)
+            Returns
+            -------
+            x, y, noise : numpy.ndarray
+                (lists of floats if numpy is not installed)
+        """
+        n = min(self._cursor[bit_] for bit_ in (0, 1, 4, 5))
+        data = self._curves
+        if np is None:
+            sens = [SENS_LUT[s] for s in data[4][:n]]
+            return tuple([v * s for v, s in zip(data[bit_][:n], sens)]
+                         for bit_ in (0, 1, 5))
+        sens = SENS_LUT[data[4][:n]]
+        x = data[0][:n] * sens
+        y = data[1][:n] * sens
+        noise = data[5][:n] * sens
+        return x, y, noise
 
     # }}}
 
     def run(self, curr_fin_voltage,
             events, lock, barrier, 
-            sample_rate=10000, len_=1000000):
+            sample_rate=10000, len_=100000):
         """ Run curve aquistion (deprecated).
 
             This was intended to run in a thread, but was replaced with the
@@ -1,15 +1,37 @@
+import queue
+
 import serial
+import serial.threaded
+
+
+class _ReplyQueue(serial.threaded.Packetizer):
+    """ Protocol for the reader thread, which queues each line received """
+    TERMINATOR = b'\n'
+
+    def __init__(self):
+        super().__init__()
+        self.replies = queue.Queue()
+
+    def handle_packet(self, packet):
+        self.replies.put(bytes(packet).strip())
 
 
 class SIM922(serial.Serial):
     """ Class for communicating to the SIM922 diode temperature monitor
 
     When the class is constructed, communication is started with the SIM922 module 
-    in the SIM900 mainframe through the specified serial port.
+    in the SIM900 mainframe through the specified serial port. A background
+    thread reads the replies from the serial port as soon as they arrive.
+
+    Because that thread consumes everything received, replies must be read
+    through .send_receive(), the .get_*() methods, or .readline(), which returns
+    the next queued reply. Do not call .read() directly: it takes data away
+    from the reader thread and gives nothing or partial lines.
 
     Common methods:
         .get_T() : retrieve the temperature in K (as calculated from the calibration curve)
         .get_V() : retrieve the voltage in mV
+        .get_TV() : retrieve both the temperature and voltage with a single query
         .send(command) : send the command string to the module (strings are sanitized)
         .send_receive(query) : send the query and return the result as a bytestring
     """
@@ -17,6 +39,14 @@ class SIM922(serial.Serial):
     def __init__(self, port='COM4', module_no=4, term_string='xxyyzz', baud=57600, timeout=0.5):
         super().__init__(port, baud, timeout=timeout)
         self._term_string=term_string
+        # the fixed queries are sanitized once, rather than on every call
+        self._q_T = self.sanitize('tval? 1')
+        self._q_V = self.sanitize('volt? 1')
+        self._q_TV = self.sanitize('tval? 1;volt? 1')
+        self._reader = serial.threaded.ReaderThread(self, _ReplyQueue)
+        self._reader.start()
+        _, protocol = self._reader.connect()
+        self._replies = protocol.replies
         self._connect_to_module(module_no) # start communication with the sim922 module
 
     def _connect_to_module(self, module_no):
@@ -29,20 +59,35 @@ class SIM922(serial.Serial):
         """
         self.send(self._term_string)
 
+    def close(self):
+        """ Stop the reader thread and close the serial port
+        """
+        reader = getattr(self, '_reader', None)
+        if reader is not None and reader.is_alive():
+            reader.stop()
+        super().close()
+
     def get_T(self):
-        return float(self.send_receive('tval? 1'))
+        return float(self._write_receive(self._q_T))
 
     def get_V(self):
-        return float(self.send_receive('volt? 1'))
+        return float(self._write_receive(self._q_V))
+
+    def get_TV(self):
+        """ Retrieve the temperature in K and voltage in mV with a single query
+        """
+        self._clear_replies()
+        self.write(self._q_TV)
+        values = []
+        while len(values) < 2:
+            values.extend(self._next_reply().split(b';'))
+        return float(values[0]), float(values[1])
         
     def send(self, command):
         self.write(self.sanitize(command))
         
     def send_receive(self, command):
-        self.reset_input_buffer()
-        self.send(command)
-        # Serial.readline() waits for a line of input (with a timeout)
-        return self.readline()
+        return self._write_receive(self.sanitize(command))
     
     def send_list(self, command_list):
             """ sends a list of commands, without waiting for a reply
@@ -54,6 +99,39 @@ class SIM922(serial.Serial):
         """
         return [self.send_receive(c) for c in command_list]
 
+    def readline(self, size=-1):
+        """ Return the next reply, waiting up to the timeout
+
+        The reader thread owns the serial port, so this reads from its queue of
+        replies instead. As with Serial.readline(), an empty bytestring is
+        returned on a timeout. <size> is ignored.
+        """
+        reply = self._next_reply()
+        return reply + b'\r\n' if reply else reply
+
+    def _write_receive(self, data):
+        """ Write the already sanitized bytes <data>, and return the reply
+        """
+        self._clear_replies()
+        self.write(data)
+        return self._next_reply()
+
+    def _clear_replies(self):
+        """ Discard any replies that have not been read yet
+        """
+        while not self._replies.empty():
+            self._replies.get_nowait()
+
+    def _next_reply(self):
+        """ Wait for the next line of input (with a timeout)
+
+        Like Serial.readline(), an empty bytestring is returned on a timeout.
+        """
+        try:
+            return self._replies.get(timeout=self.timeout)
+        except queue.Empty:
+            return b''
+
     def sanitize(self, command):
         """ Converts to bytes and puts a carriage return (\\r) at the end
         """